@@ -5,15 +5,95 @@ from pathlib import Path
 from datetime import datetime
 import traceback
 import random
+import math
+import itertools
 
-# Import the generator so we can regenerate if file missing/corrupt
 try:
-    import data_generator
-except Exception:
-    data_generator = None
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# orjson's decode error subclasses json.JSONDecodeError; ijson has its own
+DECODE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError) + ((ijson.JSONError,) if ijson else ())
+
+from prompts import load_prompt, format_prompt, flush_prompt_log
+
+# Local LLM wrapper; imported once here rather than inside button handlers
+try:
+    import model_integration_local
+except ImportError:
+    model_integration_local = None
+llm_enabled = model_integration_local is not None and model_integration_local.llm_available()
 
 st.set_page_config(page_title="Elyx — Member Journey", layout="wide")
 DATA_PATH = Path("data/messages.json")
+PAGE_SIZE = 25  # messages rendered per rerun; each one builds an expander + widgets
+STREAM_THRESHOLD_BYTES = 50_000_000  # above this, stream messages with ijson instead of one big parse
+
+@st.cache_resource(show_spinner="Loading local model ...")
+def get_llm():
+    """
+    Hold the llama_cpp handle across reruns so regenerating never loads the GGUF twice.
+    """
+    return model_integration_local.get_llm()
+
+@st.cache_resource(show_spinner=False)
+def load_generator():
+    """
+    Import data_generator (and NumPy with it) the first time a regeneration needs it, not on
+    every app start. Import errors propagate, so they are not cached and the next rerun retries.
+    """
+    import data_generator
+    return data_generator
+
+def generator_available():
+    try:
+        load_generator()
+    except Exception:
+        return False
+    return True
+
+def regenerate():
+    """Run data_generator.main() against the cached model handle."""
+    get_llm()
+    return load_generator().main()
+
+@st.cache_data(show_spinner=False)
+def _parse_data(mtime_ns, size):
+    """
+    Read and parse DATA_PATH. Cached across reruns; mtime_ns/size are the cache key,
+    so regenerating the file invalidates the cached copy.
+    Large files are not loaded at all: one streaming pass keeps only the member and the message
+    count, and the result carries "stream_key" instead of "messages" (pages come from _read_page).
+    """
+    if size > STREAM_THRESHOLD_BYTES and ijson is not None:
+        member, n_messages, builder = {}, 0, None
+        with DATA_PATH.open("rb") as fh:
+            for prefix, event, value in ijson.parse(fh, use_float=True):
+                if prefix == "messages.item" and event == "start_map":
+                    n_messages += 1
+                elif prefix == "member" and event == "start_map" and builder is None:
+                    builder = ijson.ObjectBuilder()
+                if builder is not None and (prefix == "member" or prefix.startswith("member.")):
+                    builder.event(event, value)
+                    if prefix == "member" and event == "end_map":
+                        member = builder.value
+        return {"member": member, "n_messages": n_messages, "stream_key": (mtime_ns, size)}
+    raw = DATA_PATH.read_bytes()
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode("utf-8"))
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _read_page(mtime_ns, size, start):
+    # one page of a streamed file; the pass stops as soon as the page is read
+    with DATA_PATH.open("rb") as fh:
+        return list(itertools.islice(ijson.items(fh, "messages.item", use_float=True), start, start + PAGE_SIZE))
 
 def load_data():
     """
@@ -22,23 +102,61 @@ def load_data():
     """
     if not DATA_PATH.exists() or DATA_PATH.stat().st_size == 0:
         st.warning(f"{DATA_PATH} is missing or empty.")
-        if data_generator:
+        if generator_available():
             st.info("Attempting to regenerate messages.json using data_generator.py ...")
             try:
-                data_generator.main()
+                regenerate()
             except Exception as e:
                 raise RuntimeError(f"data_generator failed: {e}")
         else:
             raise FileNotFoundError(f"{DATA_PATH} missing and data_generator module not available.")
     # At this point file should exist and be non-empty
-    text = DATA_PATH.read_text(encoding="utf-8")
+    stat = DATA_PATH.stat()
     try:
-        return json.loads(text)
-    except json.JSONDecodeError as e:
+        return _parse_data(stat.st_mtime_ns, stat.st_size)
+    except DECODE_ERRORS as e:
         # Try to give helpful debug info
-        snippet = text[:400].replace("\n", "\\n")
+        with DATA_PATH.open("rb") as fh:
+            head = fh.read(400)
+        snippet = head.decode("utf-8", errors="replace").replace("\n", "\\n")
         raise ValueError(f"JSON decode error: {e}. File starts with: {snippet}")
 
+@st.fragment
+def render_message(m, default_temp, show_prompt):
+    """
+    Render one timeline entry. Runs as a fragment so its buttons/sliders rerun only this
+    message instead of the whole script.
+    """
+    # older files predate ts_display; parse only for those
+    ts = m.get("ts_display") or datetime.fromisoformat(m["timestamp"]).strftime('%Y-%m-%d %H:%M')
+    with st.expander(f"{ts} — {m['sender']} — tags: {m.get('tags',[])}"):
+        st.write(m["text"])
+        temp_key = f"explain_temp_{m['id']}"
+        explain_temp = st.slider(
+            "Explain generation temperature",
+            min_value=0.0, max_value=1.0, value=default_temp, step=0.05, key=temp_key
+        )
+        if st.button(f"Explain {m.get('decision_id', '')}", key=f"exp_{m['id']}", disabled=not llm_enabled):
+            chosen_temp = explain_temp if explain_temp is not None else default_temp
+            # rationale generation code here, using chosen_temp
+
+        if m.get('sender_role', 'unknown') == "member":
+            # Paraphrase button (example for member messages)
+            if st.button(f"Paraphrase {m['id']}", key=f"pp_{m['id']}", disabled=not llm_enabled):
+                paraphrase_template = load_prompt("paraphrase_one.txt")
+                prompt_pp = format_prompt(paraphrase_template, member=json.dumps(member), context=m['text'])
+                variants = model_integration_local.generate_paraphrases("paraphrase_one.txt", prompt_pp, n=6, temperature=default_temp)
+                flush_prompt_log()  # the server may run for days; don't leave this click in the buffer
+                usable = [v for v in variants if len(v) > 5]
+                if show_prompt:
+                    st.markdown("**Paraphrase prompt used:**")
+                    st.code(prompt_pp)
+                if usable:
+                    st.markdown("**Paraphrased variant:**")
+                    st.write(random.choice(usable))
+                else:
+                    st.warning("The model returned no usable paraphrase.")
+
 # UI
 st.title("Elyx — Member Journey (Robust Debug Version)")
 
@@ -52,9 +170,9 @@ except Exception as e:
                 "- Ensure `data/messages.json` contains valid JSON (not empty).\n"
                 "- If you want me to regenerate now, click the button below.")
     if st.button("Try regenerate now"):
-        if data_generator:
+        if generator_available():
             try:
-                data_generator.main()
+                regenerate()
                 st.success("Regenerated data/messages.json — please restart the app (Streamlit will usually auto-reload).")
             except Exception as e2:
                 st.error(f"Regeneration failed: {e2}")
@@ -65,6 +183,7 @@ except Exception as e:
 
 member = data.get("member", {})
 messages = data.get("messages", [])
+n_messages = data["n_messages"] if "stream_key" in data else len(messages)
 
 # If we reach here, data loaded successfully
 st.sidebar.subheader("Member Snapshot")
@@ -78,31 +197,12 @@ temperature = st.sidebar.slider(
 )
 show_prompt = st.sidebar.checkbox("Show prompt used", value=False, key="show_prompt_checkbox")
 
-for m in messages:
-    ts = datetime.fromisoformat(m["timestamp"])
-    with st.expander(f"{ts.strftime('%Y-%m-%d %H:%M')} — {m['sender']} — tags: {m.get('tags',[])}"):
-        st.write(m["text"])
-        temp_key = f"explain_temp_{m['id']}"
-        explain_temp = st.slider(
-            "Explain generation temperature",
-            min_value=0.0, max_value=1.0, value=temperature, step=0.05, key=temp_key
-        )
-        if st.button(f"Explain {m.get('decision_id', '')}", key=f"exp_{m['id']}"):
-            chosen_temp = explain_temp if explain_temp is not None else temperature
-            # rationale generation code here, using chosen_temp
+# Only build widgets for the current page of the timeline
+n_pages = max(1, math.ceil(n_messages / PAGE_SIZE))
+page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1, key="timeline_page")
+st.caption(f"Page {page} of {n_pages} — {n_messages} messages")
+start = (page - 1) * PAGE_SIZE
 
-        if m.get('sender_role', 'unknown') == "member":
-            # Paraphrase button (example for member messages)
-            if st.button(f"Paraphrase {m['id']}", key=f"pp_{m['id']}"):
-                from prompts import load_prompt, format_prompt
-                from model_integration_local import generate_paraphrases
-
-                paraphrase_template = load_prompt("paraphrase_batch.txt")
-                prompt_pp = format_prompt(paraphrase_template, n=6, context=m['text'])
-                variants = generate_paraphrases("paraphrase_batch.txt", prompt_pp, n=6, temperature=temperature)
-                chosen = random.choice([v for v in variants if len(v) > 5])
-                if show_prompt:
-                    st.markdown("**Paraphrase prompt used:**")
-                    st.code(prompt_pp)
-                st.markdown("**Paraphrased variant:**")
-                st.write(chosen)
+page_messages = _read_page(*data["stream_key"], start) if "stream_key" in data else messages[start:start + PAGE_SIZE]
+for m in page_messages:
+    render_message(m, temperature, show_prompt)
@@ -9,17 +9,20 @@ Output:
   - decisions/<decision_id>.json (rationales)
 """
 
-import os
 import json
 import random
 from datetime import datetime, timedelta
 from pathlib import Path
-import uuid
-import math
-import sys
+from collections import deque
+import operator
 from typing import List, Dict, Any
+import numpy as np
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from prompts import load_prompt, format_prompt
-from model_integration_local import generate_text, generate_rationale, generate_paraphrases
+from model_integration_local import submit_paraphrases_batch, flush_cache_writes, llm_available
 
 SEED = None
 if SEED is not None:
@@ -34,38 +37,50 @@ MEMBER = {
     "location": "Singapore",
     "chronic_condition": "High LDL cholesterol"
 }
+MEMBER_JSON = json.dumps(MEMBER)
 
-def simple_similarity(a, b):
-    sa = set(a.lower().split())
-    sb = set(b.lower().split())
+def _tokens(s):
+    return frozenset(s.lower().split())
+
+def _jaccard(sa, sb):
     if not sa or not sb: return 0.0
-    return len(sa & sb) / len(sa | sb)
+    inter = len(sa & sb)
+    return inter / (len(sa) + len(sb) - inter)
+
+def simple_similarity(a, b):
+    return _jaccard(_tokens(a), _tokens(b))
 
 def dedupe_variants(candidates, min_diff=0.6):
-    seen = []
+    seen = []  # token sets of kept candidates, tokenized once each
     final = []
     for c in candidates:
-        if all(simple_similarity(c, s) < min_diff for s in seen):
-            seen.append(c)
+        tc = _tokens(c)
+        if all(_jaccard(tc, s) < min_diff for s in seen):
+            seen.append(tc)
             final.append(c)
     return final
 
-def force_variety(variants, min_count=4):
+def force_variety(variants, min_count=4, max_passes=5):
     deduped = dedupe_variants(variants)
-    # If not enough unique variants, mutate the rest
-    while len(deduped) < min_count and variants:
-        for v in variants:
-            if v not in deduped:
-                suffix = random.choice([
-                    " (just checking!)",
-                    " — wanted to confirm.",
-                    " (any thoughts?)",
-                    " (let me know!)",
-                    " (is that okay?)"
-                ])
-                mutated = v + suffix
-                if all(simple_similarity(mutated, s) < 0.6 for s in deduped):
-                    deduped.append(mutated)
+    deduped_tokens = [_tokens(d) for d in deduped]
+    # If not enough unique variants, mutate the rest (bounded: suffixes may never clear the threshold)
+    leftovers = [v for v in variants if v not in deduped]
+    for _ in range(max_passes if leftovers else 0):
+        if len(deduped) >= min_count:
+            break
+        for v in leftovers:
+            suffix = random.choice([
+                " (just checking!)",
+                " — wanted to confirm.",
+                " (any thoughts?)",
+                " (let me know!)",
+                " (is that okay?)"
+            ])
+            mutated = v + suffix
+            tm = _tokens(mutated)
+            if all(_jaccard(tm, s) < 0.6 for s in deduped_tokens):
+                deduped.append(mutated)
+                deduped_tokens.append(tm)
             if len(deduped) >= min_count:
                 break
     return deduped
@@ -91,113 +106,236 @@ ADVISOR_QUESTION_TEMPLATES = [
     "Any feedback on your recent test results?"
 ]
 
-def generate_member_question(dt: datetime, msgs: list, travel_week=False, week_index=0):
-    from_ex = random.choice(["cardio","run","HIIT","cycling"])
-    to_ex = random.choice(["strength","mobility","yoga","stretch"])
-    reason = random.choice(["urgent meeting","travel","long day","family visit"])
-    recent = "\n".join([f"{x['sender']}: {x['text']}" for x in msgs[-6:]]) if msgs else ""
-    context_obj = {
-        "member": MEMBER,
-        "date": dt.date().isoformat(),
-        "time": dt.time().isoformat(),
-        "week_index": week_index,
+# Canned question pool per sender, used when the model returns no usable variants
+FALLBACKS = {
+    "Rohan": QUESTION_TEMPLATES,
+    "Ruby": ADVISOR_QUESTION_TEMPLATES,
+    "Advik": ADVISOR_QUESTION_TEMPLATES,
+}
+
+def fallback_text(sender: str, **fields) -> str:
+    return random.choice(FALLBACKS.get(sender, ADVISOR_QUESTION_TEMPLATES)).format(**fields)
+
+# Messages are held column-wise while generating (one list per field) and only turned
+# into per-message dicts when written out
+MESSAGE_FIELDS = ("id", "timestamp", "ts_display", "sender", "sender_role", "text", "tags",
+                  "decision_id", "message_type", "meta")
+
+def new_columns() -> Dict[str, list]:
+    # "id" is assigned in materialize()
+    return {field: [] for field in MESSAGE_FIELDS[1:]}
+
+def materialize(cols: Dict[str, list]) -> List[dict]:
+    # columns are filled in timeline order, so ids (msg_000001, ...) are stable and sortable
+    rows = zip(*(cols[field] for field in MESSAGE_FIELDS[1:]))
+    return [dict(zip(MESSAGE_FIELDS, (message_id(n),) + row)) for n, row in enumerate(rows, start=1)]
+
+RECENT_CONTEXT_LEN = 6  # trailing messages quoted in each paraphrase prompt
+
+def recent_context(recent_lines: deque) -> str:
+    return "\n".join(recent_lines)
+
+def paraphrase_prompt(context_obj: dict) -> str:
+    # member profile is rendered into the fixed header, so only the per-day context varies at the tail
+    paraphrase_template = load_prompt("paraphrase_one.txt")
+    return format_prompt(paraphrase_template, member=MEMBER_JSON, context=json.dumps(context_obj))
+
+FROM_EXERCISES = ("cardio", "run", "HIIT", "cycling")
+TO_EXERCISES = ("strength", "mobility", "yoga", "stretch")
+SWAP_REASONS = ("urgent meeting", "travel", "long day", "family visit")
+ADVISOR_TOPICS = ("exercise", "medication", "nutrition", "stress", "sleep", "travel", "test results")
+ADVISORS = ("Ruby", "Advik")
+# roles are written when each message is built, so the dataset never needs a role-patching pass
+SENDER_TO_ROLE = {"Rohan":"member","Ruby":"concierge","Dr_Warren":"medical","Advik":"coach"}
+
+def plan_member_question(dt: datetime, recent: str, from_ex: str, to_ex: str, reason: str, hour_offset: int,
+                         travel_week=False, week_index=0) -> dict:
+    """Build the member question's slot and paraphrase prompt from pre-drawn details (text is filled in later)."""
+    prompt = None
+    # Without a model the prompt would be thrown away, so only build it when one is available
+    if llm_available():
+        prompt = paraphrase_prompt({
+            "date": dt.date().isoformat(),
+            "time": dt.time().isoformat(),
+            "week_index": week_index,
+            "travel_week": travel_week,
+            "from_ex": from_ex,
+            "to_ex": to_ex,
+            "reason": reason,
+            "recent_messages": recent
+        })
+    return {
+        "pool": "member",
+        "prompt": prompt,
+        "fields": {"from_ex": from_ex, "to_ex": to_ex, "reason": reason},
+        "ts": dt + timedelta(hours=10 + hour_offset),
+        "sender": "Rohan",
+        "sender_role": SENDER_TO_ROLE["Rohan"],
+        "tag": "MEMBER_QUESTION",
+        "member_initiated": True,
         "travel_week": travel_week,
-        "from_ex": from_ex,
-        "to_ex": to_ex,
-        "reason": reason,
-        "recent_messages": recent
     }
-    paraphrase_template = load_prompt("paraphrase_batch.txt")
-    paraphrase_prompt = format_prompt(paraphrase_template, n=10, context=json.dumps(context_obj))
-    variants = generate_paraphrases("paraphrase_batch.txt", paraphrase_prompt, n=10, temperature=0.85)
-    print(f"[member paraphrase pool {dt.date()}]", variants)
-    deduped = force_variety(variants, min_count=4)
-    chosen = random.choice(deduped) if deduped else random.choice(QUESTION_TEMPLATES).format(from_ex=from_ex, to_ex=to_ex, reason=reason)
-    msgs.append({
-        "id": next_id(),
-        "timestamp": now_iso(dt + timedelta(hours=10 + random.randint(0,6))),
-        "sender": "Rohan",
-        "sender_role": "member",
-        "text": chosen,
-        "tags": ["MEMBER_QUESTION"],
-        "decision_id": None,
-        "message_type": "chat",
-        "meta": {"member_initiated": True, "adherence_flag": None, "travel_week": travel_week}
-    })
-
-def generate_advisor_question(dt: datetime, msgs: list, advisor="Ruby", week_index=0, travel_week=False):
-    topic = random.choice(["exercise", "medication", "nutrition", "stress", "sleep", "travel", "test results"])
-    recent = "\n".join([f"{x['sender']}: {x['text']}" for x in msgs[-6:]]) if msgs else ""
-    context_obj = {
-        "member": MEMBER,
-        "date": dt.date().isoformat(),
-        "time": dt.time().isoformat(),
-        "week_index": week_index,
+
+def plan_advisor_question(dt: datetime, recent: str, topic: str, hour_offset: int, advisor="Ruby",
+                          week_index=0, travel_week=False) -> dict:
+    """Build the advisor question's slot and paraphrase prompt from pre-drawn details (text is filled in later)."""
+    prompt = None
+    # Without a model the prompt would be thrown away, so only build it when one is available
+    if llm_available():
+        prompt = paraphrase_prompt({
+            "date": dt.date().isoformat(),
+            "time": dt.time().isoformat(),
+            "week_index": week_index,
+            "travel_week": travel_week,
+            "topic": topic,
+            "recent_messages": recent
+        })
+    return {
+        "pool": "advisor",
+        "prompt": prompt,
+        "fields": {},
+        "ts": dt + timedelta(hours=8 + hour_offset),
+        "sender": advisor,
+        "sender_role": SENDER_TO_ROLE.get(advisor, "unknown"),
+        "tag": "ADVISOR_QUESTION",
+        "member_initiated": False,
         "travel_week": travel_week,
-        "topic": topic,
-        "recent_messages": recent
     }
-    paraphrase_template = load_prompt("paraphrase_batch.txt")
-    paraphrase_prompt = format_prompt(paraphrase_template, n=10, context=json.dumps(context_obj))
-    variants = generate_paraphrases("paraphrase_batch.txt", paraphrase_prompt, n=10, temperature=0.85)
-    print(f"[advisor paraphrase pool {dt.date()}]", variants)
+
+def finish_question(slot: dict, variants: List[str], cols: Dict[str, list], recent_lines: deque):
+    """
+    Pick the final text for a planned question from its variant pool, append the message and
+    push its pre-formatted line onto the rolling recent-context window.
+    """
+    ts = slot["ts"]
+    if slot["prompt"] is not None:
+        print(f"[{slot['pool']} paraphrase pool {ts.date()}]", variants)
     deduped = force_variety(variants, min_count=4)
-    chosen = random.choice(deduped) if deduped else random.choice(ADVISOR_QUESTION_TEMPLATES)
-    msgs.append({
-        "id": next_id(),
-        "timestamp": now_iso(dt + timedelta(hours=8 + random.randint(0,6))),
-        "sender": advisor,
-        "sender_role": "concierge" if advisor == "Ruby" else "coach",
-        "text": chosen,
-        "tags": ["ADVISOR_QUESTION"],
-        "decision_id": None,
-        "message_type": "chat",
-        "meta": {"member_initiated": False, "adherence_flag": None, "travel_week": travel_week}
-    })
+    chosen = random.choice(deduped) if deduped else fallback_text(slot["sender"], **slot["fields"])
+    iso, shown = slot_timestamps(ts)
+    cols["timestamp"].append(iso)
+    cols["ts_display"].append(shown)
+    cols["sender"].append(slot["sender"])
+    cols["sender_role"].append(slot["sender_role"])
+    cols["text"].append(chosen)
+    recent_lines.append(f"{slot['sender']}: {chosen}")
+    cols["tags"].append([slot["tag"]])
+    cols["decision_id"].append(None)
+    cols["message_type"].append("chat")
+    cols["meta"].append({"member_initiated": slot["member_initiated"], "adherence_flag": None, "travel_week": slot["travel_week"]})
 
 START_DATE = datetime(2025, 1, 1)
 DAYS = 8 * 30  # 8 months
+MEMBER_MSG_DAILY_P = 0.2
+ADVISOR_MSG_DAILY_P = 0.15
+BATCH_DAYS = 7  # days planned per paraphrase batch; recent context is taken at the start of each window
 
-msgs = []
-for day in range(DAYS):
-    dt = START_DATE + timedelta(days=day)
-    week_index = day // 7
-    travel_week = (week_index % 4 == 2)
-    # Member question (random chance)
-    if random.random() < 0.2:
-        generate_member_question(dt, msgs, travel_week=travel_week, week_index=week_index)
-    # Advisor question (random chance)
-    if random.random() < 0.15:
-        advisor = random.choice(["Ruby", "Advik"])
-        generate_advisor_question(dt, msgs, advisor=advisor, week_index=week_index, travel_week=travel_week)
+# Every generated timestamp is START_DATE + whole days + whole hours, so the date part of each day
+# is formatted once (in bulk) and timestamps are assembled from it instead of isoformat/strftime
+START_ORDINAL = START_DATE.toordinal()
+DAY_ISO = np.datetime_as_string(np.datetime64(START_DATE.date()) + np.arange(DAYS), unit="D").tolist()
+_iso_cache: Dict[tuple, tuple] = {}
 
-# Save messages to JSON file
-output_dir = Path("data")
-output_dir.mkdir(exist_ok=True)
-with open(output_dir / "messages.json", "w") as f:
-    json.dump(msgs, f, indent=2, default=str)
+def slot_timestamps(ts: datetime) -> tuple:
+    """(timestamp, ts_display) strings for a generated datetime, cached per (day offset, hour)."""
+    key = (ts.toordinal() - START_ORDINAL, ts.hour)
+    strings = _iso_cache.get(key)
+    if strings is None:
+        date = DAY_ISO[key[0]]
+        strings = _iso_cache[key] = (f"{date}T{key[1]:02d}:00:00", f"{date} {key[1]:02d}:00")
+    return strings
 
-print(f"Generated {len(msgs)} messages.")
+def write_output(path: Path, obj):
+    """Pretty-print obj as JSON to path, using orjson when available."""
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE, default=str))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, indent=2, ensure_ascii=False, default=str)
 
-import uuid
+class MissingRoleError(ValueError):
+    """Raised by main() when a generated message has no known sender_role; nothing has been written."""
 
-def next_id():
-    return str(uuid.uuid4())
+def missing_roles(cols: Dict[str, list]) -> np.ndarray:
+    """
+    Row indices whose sender_role is unset or not one of SENDER_TO_ROLE's roles (an unmapped
+    sender is planned as "unknown"); the in-memory form of validate_messages.py's check.
+    """
+    known = set(SENDER_TO_ROLE.values())
+    return np.flatnonzero(np.fromiter((r not in known for r in cols["sender_role"]), dtype=bool,
+                                      count=len(cols["sender_role"])))
 
-def now_iso(dt):
-    return dt.isoformat()
+def main():
+    cols = new_columns()
+    recent_lines = deque(maxlen=RECENT_CONTEXT_LEN)
+    # Decide up front which days get a member / advisor question and every categorical pick
+    # (one vectorized draw each); plain-int lists keep the loop free of NumPy scalars
+    rng = np.random.default_rng(SEED)
+    member_fire = rng.random(DAYS) < MEMBER_MSG_DAILY_P
+    advisor_fire = rng.random(DAYS) < ADVISOR_MSG_DAILY_P
+    from_idx = rng.integers(0, len(FROM_EXERCISES), DAYS).tolist()
+    to_idx = rng.integers(0, len(TO_EXERCISES), DAYS).tolist()
+    reason_idx = rng.integers(0, len(SWAP_REASONS), DAYS).tolist()
+    member_hour = rng.integers(0, 7, DAYS).tolist()
+    advisor_idx = rng.integers(0, len(ADVISORS), DAYS).tolist()
+    topic_idx = rng.integers(0, len(ADVISOR_TOPICS), DAYS).tolist()
+    advisor_hour = rng.integers(0, 7, DAYS).tolist()
+    fire_days = np.flatnonzero(member_fire | advisor_fire)
+    member_fire, advisor_fire = member_fire.tolist(), advisor_fire.tolist()
+    # Calendar facts per day, computed once: week number and whether it is a travel week
+    week_index_by_day = [d // 7 for d in range(DAYS)]
+    travel_by_day = [w % 4 == 2 for w in week_index_by_day]
+    for window_start in range(0, DAYS, BATCH_DAYS):
+        # Pass 1: plan every question in the window and collect the prompts
+        recent = recent_context(recent_lines)
+        slots = []
+        in_window = fire_days[(fire_days >= window_start) & (fire_days < window_start + BATCH_DAYS)]
+        for day in in_window.tolist():
+            dt = START_DATE + timedelta(days=day)
+            week_index = week_index_by_day[day]
+            travel_week = travel_by_day[day]
+            day_slots = []
+            if member_fire[day]:
+                day_slots.append(plan_member_question(
+                    dt, recent, FROM_EXERCISES[from_idx[day]], TO_EXERCISES[to_idx[day]], SWAP_REASONS[reason_idx[day]],
+                    member_hour[day], travel_week=travel_week, week_index=week_index))
+            if advisor_fire[day]:
+                day_slots.append(plan_advisor_question(
+                    dt, recent, ADVISOR_TOPICS[topic_idx[day]], advisor_hour[day], advisor=ADVISORS[advisor_idx[day]],
+                    week_index=week_index, travel_week=travel_week))
+            # Days are visited in order, so ordering each day's (at most two) questions by time
+            # keeps the whole timeline sorted and no final sort is needed
+            slots.extend(sorted(day_slots, key=operator.itemgetter("ts")))
+        # Pass 2: queue the whole window on the model worker (every slot shares paraphrase_one.txt),
+        # then fill in texts as results land, so dedupe/selection overlaps the next decode
+        prompts = [slot["prompt"] for slot in slots if slot["prompt"] is not None]
+        pending = iter(submit_paraphrases_batch("paraphrase_one.txt", prompts, n=10, temperature=0.85))
+        for slot in slots:
+            finish_question(slot, list(next(pending).result()) if slot["prompt"] is not None else [], cols, recent_lines)
 
-SENDER_TO_ROLE = {"Rohan":"member","Ruby":"concierge","Dr_Warren":"medical","Advik":"coach"}
+    # Validate before anything is written, so a bad run never leaves a dataset to patch up
+    missing = missing_roles(cols)
+    if missing.size:
+        bad = "\n".join(f"{message_id(i + 1)} {cols['sender'][i]} {cols['text'][i][:80]}" for i in missing.tolist())
+        raise MissingRoleError(f"Messages missing a known sender_role:\n{bad}")
 
-def make_message(ts, sender, text, tags=None, decision_id=None, mtype="chat", meta=None):
-    return {
-        "id": next_id(),
-        "timestamp": ts.isoformat() if hasattr(ts, "isoformat") else str(ts),
-        "sender": sender,
-        "sender_role": SENDER_TO_ROLE.get(sender, "unknown"),
-        "text": text,
-        "tags": tags or [],
-        "decision_id": decision_id,
-        "message_type": mtype,
-        "meta": meta or {"member_initiated": False, "adherence_flag": None, "travel_week": False}
-    }
+    msgs = materialize(cols)
+
+    # Save messages to JSON file (same {"member", "messages"} shape app.py reads)
+    output_dir = Path("data")
+    output_dir.mkdir(exist_ok=True)
+    write_output(output_dir / "messages.json", {"member": MEMBER, "messages": msgs})
+
+    flush_cache_writes()
+    member_msgs = cols["sender_role"].count("member")
+    print(f"Generated {len(msgs)} messages ({member_msgs} member-initiated, {len(msgs) - member_msgs} from advisors).")
+    return msgs
+
+def message_id(n: int) -> str:
+    return f"msg_{n:06d}"
+
+if __name__ == "__main__":
+    try:
+        main()
+    except MissingRoleError as e:
+        raise SystemExit(str(e))
@@ -1,27 +1,130 @@
 # model_integration_local.py
 import os
 import json
-from llama_cpp import Llama
-from typing import List, Dict, Any
-from prompts import log_prompt_usage
+import hashlib
+import importlib.util
+import random
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from prompts import log_prompt_usage, flush_prompt_log
 
 MODEL_PATH = os.getenv("LLAMA_GGUF_PATH", "models/mistral-7b-instruct-v0.2.Q4_K_M.gguf")
+USE_LLM = os.getenv("USE_LLM", "1") != "0"  # USE_LLM=0 forces the canned fallbacks
 N_CTX = int(os.getenv("LLM_N_CTX", "2048"))
 N_THREADS = int(os.getenv("LLM_N_THREADS", "8"))
+N_BATCH = int(os.getenv("LLM_N_BATCH", "512"))
+PROMPT_CACHE_BYTES = int(os.getenv("LLM_PROMPT_CACHE_BYTES", str(2 << 30)))  # KV state kept for prefix reuse
+CACHE_DIR = Path(os.getenv("LLM_CACHE_DIR", "data/.llm_cache"))
+PARAPHRASE_MAX_TOKENS = int(os.getenv("LLM_PARAPHRASE_MAX_TOKENS", "48"))  # one short question per sample
+CACHE_POOL_SIZE = int(os.getenv("LLM_CACHE_POOL_SIZE", "4"))  # outputs kept per sampled (temperature>0) prompt
 
-# Initialize model once
-_llm = Llama(model_path=MODEL_PATH, n_ctx=N_CTX, n_threads=N_THREADS,seed=None)
+# Cache files are written off the generation path; one worker keeps writes in submission order
+_io_pool = ThreadPoolExecutor(max_workers=1)
+# Every model call runs on one worker too: the Llama handle is shared process-wide (and across app
+# sessions) and is not safe for concurrent calls, but while it decodes (GIL released) the caller
+# can post-process earlier results. Code already running on the worker calls the handle directly.
+_llm_pool = ThreadPoolExecutor(max_workers=1)
 
+@lru_cache(maxsize=1)
+def get_llm() -> Optional[Any]:
+    """
+    Load the model on first use and reuse the same handle for the rest of the process.
+    Returns None (cached, so it is not retried) when USE_LLM is off or the model cannot load.
+    Prompts share a static prefix (template + member profile), so a RAM prompt cache lets
+    llama_cpp skip re-prefilling it on every call.
+    """
+    if not USE_LLM:
+        return None
+    try:
+        from llama_cpp import Llama, LlamaRAMCache
+        llm = Llama(model_path=MODEL_PATH, n_ctx=N_CTX, n_threads=N_THREADS, n_batch=N_BATCH, seed=None)
+    except Exception as e:
+        print(f"[model_integration_local] LLM unavailable, using fallbacks: {e}")
+        return None
+    if PROMPT_CACHE_BYTES > 0:
+        llm.set_cache(LlamaRAMCache(capacity_bytes=PROMPT_CACHE_BYTES))
+    return llm
+
+def _on_model_worker(fn, *args, **kwargs):
+    # blocking call on _llm_pool, for model calls made from a caller's own thread
+    return _llm_pool.submit(fn, *args, **kwargs).result()
+
+@lru_cache(maxsize=1)
+def llm_available() -> bool:
+    """
+    Cheap check callers use to skip building prompts that no model will read: USE_LLM is on,
+    the GGUF exists and llama_cpp is importable (found, not imported). It approximates
+    get_llm() without loading the model, so a model that fails to load still shows up only as
+    get_llm() returning None.
+    """
+    return USE_LLM and Path(MODEL_PATH).exists() and importlib.util.find_spec("llama_cpp") is not None
+
+def _complete(prompt_text: str, max_tokens: int, temperature: float) -> str:
+    """
+    Return the completion text for prompt_text, served from CACHE_DIR when possible.
+    Greedy (temperature 0) prompts are cached exactly. Sampled prompts keep a pool of up to
+    CACHE_POOL_SIZE past outputs (each drawn with its own content-derived seed) and only reuse once
+    it is full.
+    """
+    key = hashlib.sha256(f"{MODEL_PATH}|{temperature}|{max_tokens}|{prompt_text}".encode("utf-8")).hexdigest()
+    path = CACHE_DIR / f"{key}.json"
+    pool = []
+    if path.exists():
+        try:
+            pool = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            pool = []
+    if pool and (temperature <= 0 or len(pool) >= CACHE_POOL_SIZE):
+        return random.choice(pool)
+    llm = get_llm()
+    if llm is None:
+        return ""
+    # seed derives from the prompt content, so a given prompt's pool is reproducible run to run
+    seed = (int(key[:8], 16) + len(pool)) & 0x7FFFFFFF
+    resp = _on_model_worker(llm.create_completion, prompt=prompt_text, max_tokens=max_tokens, temperature=temperature, seed=seed)
+    try:
+        raw = resp["choices"][0]["text"].strip()
+    except Exception:
+        return str(resp)
+    pool.append(raw)
+    _queue_cache_write(path, pool)
+    return raw
+
+def _write_cache(path: Path, pool: List[str]):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(pool, ensure_ascii=False), encoding="utf-8")
+
+def _report_write_error(fut: Future):
+    # nothing holds on to write futures (the app never drains them), so failures are logged here
+    if fut.exception() is not None:
+        print(f"[model_integration_local] cache write failed: {fut.exception()}")
+
+def _queue_cache_write(path: Path, pool: List[str]):
+    _io_pool.submit(_write_cache, path, pool).add_done_callback(_report_write_error)
+
+def flush_cache_writes():
+    """
+    Block until every cache write queued so far has finished (failures are logged, not raised),
+    and push buffered prompt-usage records to disk.
+    """
+    # the single I/O worker runs writes in order, so a no-op queued last finishes after all of them
+    _io_pool.submit(lambda: None).result()
+    flush_prompt_log()
 
-def _log_and_call(prompt_name: str, prompt_text: str, meta: dict):
+def _log_and_call(prompt_name: str, prompt_text: str, meta: dict) -> str:
     # record the prompt for reproducibility
     log_prompt_usage(prompt_name, prompt_text, meta)
-    # do the call and return raw response dict
-    resp = _llm(prompt=prompt_text, max_tokens=meta.get("max_tokens", 200), temperature=meta.get("temperature", 0.2))
-    return resp
+    # do the call (or cache lookup) and return the raw completion text
+    return _complete(prompt_text, meta.get("max_tokens", 200), meta.get("temperature", 0.2))
 
 def generate_text(prompt, temperature=0.9, max_tokens=128):
-    output = _llm(
+    llm = get_llm()
+    if llm is None:
+        return ""
+    output = _on_model_worker(
+        llm,
         prompt=prompt,
         max_tokens=max_tokens,
         temperature=temperature,
@@ -33,47 +136,86 @@ def generate_text(prompt, temperature=0.9, max_tokens=128):
     )
     return output["choices"][0]["text"].strip()
 
-def generate_paraphrases(prompt_name: str, prompt_text: str, n: int=6, temperature: float=0.7, max_tokens: int=512) -> List[str]:
+def _clean_variant(raw: str) -> str:
+    # one completion is one variant: keep its first line, minus list markers and quotes
+    line = raw.strip().split("\n", 1)[0]
+    return line.strip(" -•\t\"'")
+
+def _sample_completions(prompt_text: str, n: int, max_tokens: int, temperature: float) -> List[str]:
     """
-    Ask the model to return a JSON array of n paraphrases. The caller should pass a prompt that
-    requests a JSON array. We parse and return a list of strings.
+    Draw n independent short completions of prompt_text, served from CACHE_DIR when possible.
+    After the first sample the prompt tokens are still in the KV cache, so each later
+    create_completion only re-evaluates the last prompt token (longest-prefix match) before
+    decoding max_tokens.
     """
-    meta = {"temperature": 1, "max_tokens": max_tokens, "n_variants": n, "model_path": MODEL_PATH}
-    resp = _log_and_call(prompt_name, prompt_text, meta)
-    raw = ""
+    key = hashlib.sha256(f"{MODEL_PATH}|{temperature}|{max_tokens}|{n}|{prompt_text}".encode("utf-8")).hexdigest()
+    path = CACHE_DIR / f"{key}.json"
+    if path.exists():
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            pass
+    llm = get_llm()
+    if llm is None:
+        return []
+    base_seed = int(key[:8], 16)
+    out = []
+    ram_cache = llm.cache
     try:
-        raw = resp["choices"][0]["text"].strip()
-    except Exception:
-        raw = str(resp)
-    # try to parse JSON array first
-    try:
-        arr = json.loads(raw)
-        if isinstance(arr, list):
-            return [str(x).strip() for x in arr]
-    except Exception:
-        # fallback: split lines, bullets, etc.
-        lines = [ln.strip(" -•\t\n\r") for ln in raw.splitlines() if ln.strip()]
-        # minimal sanitization and return up to n
-        out = []
-        for ln in lines:
-            if len(ln) > 3:
-                out.append(ln)
-            if len(out) >= n:
-                break
-        if out:
-            return out
-    # ultimate fallback: return raw as single entry
-    return [raw] if raw else []
+        for i in range(n):
+            # seed derives from the prompt content, so a given prompt's samples are reproducible
+            resp = llm.create_completion(prompt=prompt_text, max_tokens=max_tokens, temperature=temperature,
+                                         seed=(base_seed + i) & 0x7FFFFFFF, stop=["\n", "</s>"])
+            # the first sample may restore a shared prefix from the RAM cache and stores one state
+            # back; later samples reuse the live KV state, so skip snapshotting it n more times
+            llm.cache = None
+            try:
+                out.append(resp["choices"][0]["text"])
+            except Exception:
+                out.append(str(resp))
+    finally:
+        llm.cache = ram_cache
+    _queue_cache_write(path, out)
+    return out
+
+@lru_cache(maxsize=256)
+def _paraphrase_variants(prompt_text: str, n: int, temperature: float, max_tokens: int) -> tuple:
+    # in-memory memo in front of the disk cache: a repeated prompt reuses its variant pool
+    variants = (_clean_variant(raw) for raw in _sample_completions(prompt_text, n, max_tokens, temperature))
+    return tuple(v for v in variants if len(v) > 3)
+
+def submit_paraphrases_batch(prompt_name: str, prompt_texts: List[str], n: int=6, temperature: float=0.7, max_tokens: int=PARAPHRASE_MAX_TOKENS) -> List[Future]:
+    """
+    Queue several paraphrase prompts on the model worker and return one future per prompt, in
+    input order. Each resolves to the parsed tuple of variants.
+    Every prompt is logged here, so memo and disk-cache hits are recorded too.
+    """
+    meta = {"temperature": temperature, "max_tokens": max_tokens, "n_variants": n, "model_path": MODEL_PATH}
+    futures = []
+    for prompt_text in prompt_texts:
+        log_prompt_usage(prompt_name, prompt_text, meta)
+        futures.append(_llm_pool.submit(_paraphrase_variants, prompt_text, n, temperature, max_tokens))
+    return futures
+
+def generate_paraphrases_batch(prompt_name: str, prompt_texts: List[str], n: int=6, temperature: float=0.7, max_tokens: int=PARAPHRASE_MAX_TOKENS) -> List[List[str]]:
+    """
+    Run several paraphrase prompts back-to-back on the same warm model handle (through the
+    response cache) and return one list of variants per prompt, in input order.
+    """
+    futures = submit_paraphrases_batch(prompt_name, prompt_texts, n=n, temperature=temperature, max_tokens=max_tokens)
+    return [list(f.result()) for f in futures]
+
+def generate_paraphrases(prompt_name: str, prompt_text: str, n: int=6, temperature: float=0.7, max_tokens: int=PARAPHRASE_MAX_TOKENS) -> List[str]:
+    """
+    Sample n independent paraphrases of a prompt that asks for ONE paraphrase (see
+    prompts/paraphrase_one.txt) and return the usable ones as a list of strings.
+    """
+    return generate_paraphrases_batch(prompt_name, [prompt_text], n=n, temperature=temperature, max_tokens=max_tokens)[0]
 
 def generate_rationale(prompt_name: str, prompt_text: str, temperature: float=0.0, max_tokens: int=300) -> Dict[str,Any]:
     """Return parsed JSON if model returns JSON, else a safe dict with raw text."""
     meta = {"temperature": temperature, "max_tokens": max_tokens, "model_path": MODEL_PATH}
-    resp = _log_and_call(prompt_name, prompt_text, meta)
-    raw = ""
-    try:
-        raw = resp["choices"][0]["text"].strip()
-    except Exception:
-        raw = str(resp)
+    raw = _log_and_call(prompt_name, prompt_text, meta)
     # attempt JSON parse
     try:
         parsed = json.loads(raw)
@@ -4,30 +4,112 @@ from pathlib import Path
 from collections import ChainMap
 from datetime import datetime
 import os
+import atexit
+import string
+import threading
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 PROMPTS_DIR = Path("prompts")
 LOG_DIR = Path("prompts/logs")
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 USAGE_LOG = LOG_DIR / "prompt_usage.jsonl"
+LOG_FLUSH_EVERY = 32  # records buffered between flushes of the usage log
+
+_log_fh = None
+_log_unflushed = 0
+# log_prompt_usage runs on both the caller's thread and the model worker
+_log_lock = threading.Lock()
+
+def _usage_log():
+    # one long-lived buffered handle instead of open/close per logged call; caller holds _log_lock
+    global _log_fh
+    if _log_fh is None:
+        _log_fh = open(USAGE_LOG, "ab", buffering=1 << 16)
+        atexit.register(_log_fh.close)
+    return _log_fh
+
+def flush_prompt_log():
+    """Push buffered usage records to disk; call when a run or an interactive request ends."""
+    global _log_unflushed
+    with _log_lock:
+        if _log_fh is not None:
+            _log_fh.flush()
+        _log_unflushed = 0
+
+@lru_cache(maxsize=None)
+def _read_prompt(path: Path, mtime_ns: int) -> str:
+    # mtime_ns is only part of the cache key, so an edited template is re-read
+    return path.read_text(encoding="utf-8")
 
 def load_prompt(name: str) -> str:
     """
     Load a prompt file from prompts/<name>.txt (or .md).
+    Contents are cached; a stat per call picks up edits to the file.
     """
     p = PROMPTS_DIR / name
-    if not p.exists():
-        raise FileNotFoundError(f"Prompt file not found: {p}")
-    return p.read_text(encoding="utf-8")
+    try:
+        mtime_ns = p.stat().st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Prompt file not found: {p}") from None
+    return _read_prompt(p, mtime_ns)
 
 class SafeDict(dict):
     def __missing__(self, key):
         return "{" + key + "}"
 
+@lru_cache(maxsize=128)
+def _template_fields(prompt_template: str) -> frozenset:
+    # top-level placeholder names, parsed once per distinct template
+    return frozenset(
+        field.split(".", 1)[0].split("[", 1)[0]
+        for _, field, _, _ in string.Formatter().parse(prompt_template)
+        if field
+    )
+
+_CONVERSIONS = {"r": repr, "s": str, "a": ascii}
+
+@lru_cache(maxsize=128)
+def _template_segments(prompt_template: str):
+    """
+    Split a template once into (literal, field, conversion, spec) segments for the partial
+    formatter. Returns None for templates it doesn't handle (positional, attribute/index or
+    nested-spec fields); those keep the SafeDict path.
+    """
+    segments = []
+    for literal, field, spec, conversion in string.Formatter().parse(prompt_template):
+        if field is not None and (not field or "." in field or "[" in field or "{" in (spec or "")):
+            return None
+        segments.append((literal, field, conversion, spec or ""))
+    return tuple(segments)
+
+def _format_partial(segments, kwargs: dict) -> str:
+    # same output as format_map(SafeDict(...)): missing names render as "{name}"
+    parts = []
+    for literal, field, conversion, spec in segments:
+        parts.append(literal)
+        if field is not None:
+            value = kwargs[field] if field in kwargs else "{" + field + "}"
+            if conversion:
+                value = _CONVERSIONS[conversion](value)
+            parts.append(format(value, spec))
+    return "".join(parts)
+
 def format_prompt(prompt_template: str, **kwargs) -> str:
     """
     Safely format a prompt template using {placeholders}.
     Unknown placeholders are left as-is (so formatting won't crash).
     """
+    if _template_fields(prompt_template) <= kwargs.keys():
+        # every placeholder is supplied: plain str.format, no SafeDict needed
+        return prompt_template.format(**kwargs)
+    segments = _template_segments(prompt_template)
+    if segments is not None:
+        return _format_partial(segments, kwargs)
     safe = SafeDict(**kwargs)
     return prompt_template.format_map(safe)
 
@@ -42,5 +124,15 @@ def log_prompt_usage(prompt_name: str, rendered_prompt: str, metadata: dict):
         "prompt": rendered_prompt,
         "meta": metadata
     }
-    with open(USAGE_LOG, "a", encoding="utf-8") as fh:
-        fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if orjson is not None:
+        line = orjson.dumps(record) + b"\n"
+    else:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    global _log_unflushed
+    with _log_lock:
+        fh = _usage_log()
+        fh.write(line)
+        _log_unflushed += 1
+        if _log_unflushed >= LOG_FLUSH_EVERY:
+            fh.flush()
+            _log_unflushed = 0
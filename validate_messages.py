@@ -1,11 +1,26 @@
 # validate_messages.py
+# Read-only check for datasets written by older generators; data_generator.py now runs the same
+# check on its columns before writing messages.json.
 import json
 from pathlib import Path
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 DATA_PATH = Path("data/messages.json")
-doc = json.loads(DATA_PATH.read_text(encoding="utf-8"))
-msgs = doc.get("messages", [])
+
+def iter_messages(path: Path):
+    # stream one message at a time when ijson is available
+    if ijson is None:
+        yield from json.loads(path.read_text(encoding="utf-8")).get("messages", [])
+        return
+    with path.open("rb") as fh:
+        yield from ijson.items(fh, "messages.item", use_float=True)
+
 bad = []
-for i, m in enumerate(msgs, start=1):
+for i, m in enumerate(iter_messages(DATA_PATH), start=1):
     if "sender_role" not in m:
         bad.append((i, m.get("sender"), m.get("text")[:80]))
 if bad: